@@ -0,0 +1,342 @@
+from database import read_query, write_query, execute_write, background_worker
+import logging
+import os
+import re
+import threading
+
+# User field → relationship created when two users share it
+ATTRIBUTES = {
+    "email":          "SHARED_EMAIL",
+    "phone":          "SHARED_PHONE",
+    "address":        "SHARED_ADDRESS",
+    "payment_method": "SHARED_PAYMENT",
+}
+
+# A value shared by more users than this is treated as a hub
+# (e.g. a placeholder email or a shared office address).
+# New users are flagged instead of being linked to every member.
+HUB_CAP = int(os.getenv("ATTRIBUTE_HUB_CAP", "50"))
+
+# How often stored keys are backfilled and the cache is rebuilt, so users
+# written outside this process (seed script, other instances) are covered
+REFRESH_SECONDS = int(os.getenv("ATTRIBUTE_INDEX_REFRESH_SECONDS", "300"))
+RETRY_SECONDS = 15
+WRITE_BATCH_SIZE = 500
+
+logger = logging.getLogger(__name__)
+
+
+def key_property(attr):
+    # Node property holding the normalized value, e.g. "email_norm"
+    return f"{attr}_norm"
+
+
+# ══════════════════════════════════
+# NORMALIZATION
+# ══════════════════════════════════
+
+# Providers that deliver "a.b+x@" to "ab@" (googlemail.com is gmail.com)
+DOT_INSENSITIVE_DOMAINS = {"gmail.com", "googlemail.com"}
+
+
+def normalize_email(value):
+    # "John.Doe+promo@Gmail.com" → "johndoe@gmail.com"
+    # Dots and +tags are only dropped where the provider ignores them;
+    # elsewhere "j.smith@corp.com" and "jsmith@corp.com" are different people
+    value = value.strip().lower()
+    if "@" not in value:
+        return value
+    local, domain = value.rsplit("@", 1)
+    if domain in DOT_INSENSITIVE_DOMAINS:
+        local = local.split("+", 1)[0].replace(".", "")
+        domain = "gmail.com"
+    return f"{local}@{domain}"
+
+
+def normalize_phone(value):
+    # "+91-98765-43210", "098765 43210" → "9876543210"
+    # Keeps the last 10 digits so country code / trunk 0 don't matter
+    return re.sub(r"\D", "", value)[-10:]
+
+
+def normalize_address(value):
+    # Case, punctuation and spacing differences are ignored
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", value.lower()).split())
+
+
+def normalize_payment(value):
+    return " ".join(value.lower().split())
+
+
+NORMALIZERS = {
+    "email":          normalize_email,
+    "phone":          normalize_phone,
+    "address":        normalize_address,
+    "payment_method": normalize_payment,
+}
+
+
+def normalize(attr, value):
+    # Returns None for blank values so they never link users together
+    if not value:
+        return None
+    return NORMALIZERS[attr](str(value)) or None
+
+
+# ══════════════════════════════════
+# IN-MEMORY CACHE
+# ══════════════════════════════════
+
+class AttributeIndex:
+    """
+    In-memory inverted index: normalized attribute value → user ids.
+    Only a cache for hub statistics — links are always decided from
+    the *_norm properties in Neo4j, which every instance shares.
+    Rebuilt from Neo4j on a schedule and updated by every POST /users.
+    """
+
+    def __init__(self, hub_cap=HUB_CAP):
+        self.hub_cap = hub_cap
+        self.loaded = False
+        self._lock = threading.Lock()
+        self._values = {attr: {} for attr in ATTRIBUTES}   # attr → value → {ids}
+        self._by_user = {}                                 # id → {attr: value}
+        self._touched = None   # id → user added while a load is in progress
+
+    def begin_load(self):
+        # Call before reading the snapshot that will be passed to load()
+        with self._lock:
+            self._touched = {}
+
+    def load(self, users):
+        """
+        Replaces the cache with a snapshot of user dicts, so users deleted
+        in Neo4j drop out. Users added since begin_load() are replayed on
+        top, so an older snapshot never overwrites or drops them.
+        """
+        values = {attr: {} for attr in ATTRIBUTES}
+        by_user = {}
+        for user in users:
+            _insert(values, by_user, user)
+        with self._lock:
+            for user in (self._touched or {}).values():
+                _insert(values, by_user, user)
+            self._touched = None
+            self._values, self._by_user = values, by_user
+            self.loaded = True
+
+    def add(self, user):
+        with self._lock:
+            _insert(self._values, self._by_user, user)
+            if self._touched is not None:
+                self._touched[user["id"]] = user
+
+    def stats(self, top=10):
+        # Hub-size statistics per attribute, largest shared values first
+        with self._lock:
+            result = {"users": len(self._by_user), "hub_cap": self.hub_cap,
+                      "attributes": {}}
+            for attr, buckets in self._values.items():
+                sizes = sorted(((len(ids), value) for value, ids in buckets.items()),
+                               reverse=True)
+                result["attributes"][attr] = {
+                    "distinct_values": len(buckets),
+                    "shared_values": sum(1 for size, _ in sizes if size > 1),
+                    "largest": sizes[0][0] if sizes else 0,
+                    "over_cap": sum(1 for size, _ in sizes if size > self.hub_cap),
+                    "top": [{"value": value, "users": size}
+                            for size, value in sizes[:top] if size > 1],
+                }
+            return result
+
+
+def _insert(values, by_user, user):
+    # Caller holds the lock (or owns the maps). Re-inserting a user first
+    # drops their old values so an updated email stops matching.
+    user_id = user["id"]
+    for attr, value in by_user.pop(user_id, {}).items():
+        members = values[attr].get(value)
+        if members is not None:
+            members.discard(user_id)
+            if not members:
+                del values[attr][value]
+
+    keys = {}
+    for attr in ATTRIBUTES:
+        value = normalize(attr, user.get(attr))
+        if value is None:
+            continue
+        values[attr].setdefault(value, set()).add(user_id)
+        keys[attr] = value
+    by_user[user_id] = keys
+
+
+index = AttributeIndex()
+
+
+# ══════════════════════════════════
+# NEO4J KEYS + RECONCILIATION
+# ══════════════════════════════════
+
+_refresh_lock = threading.Lock()
+
+
+def create_key_indexes():
+    # *_norm for normalized lookups; raw address / payment_method for
+    # the fallback on users whose keys haven't been backfilled yet
+    for attr in ATTRIBUTES:
+        prop = key_property(attr)
+        write_query(f"CREATE INDEX user_{prop}_idx IF NOT EXISTS FOR (u:User) ON (u.{prop})")
+    write_query("CREATE INDEX user_address_idx IF NOT EXISTS FOR (u:User) ON (u.address)")
+    write_query("CREATE INDEX user_payment_idx IF NOT EXISTS FOR (u:User) ON (u.payment_method)")
+
+
+def _key_params(user):
+    return {key_property(attr): normalize(attr, user.get(attr)) for attr in ATTRIBUTES}
+
+
+# Backfill only touches a user whose raw values still match the snapshot,
+# so it never overwrites keys a concurrent POST /users just wrote
+_BACKFILL_QUERY = """
+    UNWIND $batch AS row
+    MATCH (u:User {id: row.id})
+    WHERE """ + "\n      AND ".join(
+    f"coalesce(u.{attr}, '') = coalesce(row.raw.{attr}, '')" for attr in ATTRIBUTES
+) + """
+    SET u += row.keys
+"""
+
+
+def _refresh_locked():
+    # Caller holds _refresh_lock
+    create_key_indexes()
+    index.begin_load()
+    fields = ", ".join(f"u.{a} AS {a}, u.{key_property(a)} AS {key_property(a)}"
+                       for a in ATTRIBUTES)
+    users = [dict(r) for r in read_query(f"MATCH (u:User) RETURN u.id AS id, {fields}")]
+
+    stale = []
+    for user in users:
+        keys = _key_params(user)
+        if any(user.get(prop) != value for prop, value in keys.items()):
+            stale.append({"id": user["id"], "keys": keys,
+                          "raw": {attr: user.get(attr) for attr in ATTRIBUTES}})
+    for i in range(0, len(stale), WRITE_BATCH_SIZE):
+        write_query(_BACKFILL_QUERY, batch=stale[i:i + WRITE_BATCH_SIZE])
+
+    index.load(users)
+    logger.info("Attribute index refreshed: %d users, %d keys backfilled",
+                len(users), len(stale))
+    return len(users)
+
+
+def refresh():
+    """
+    Reconciles Neo4j and the cache:
+    1. Writes *_norm keys on users that lack them or have stale ones
+       (e.g. loaded by seed_data.py or direct Cypher)
+    2. Rebuilds the in-memory cache from every user
+    """
+    with _refresh_lock:
+        return _refresh_locked()
+
+
+# ══════════════════════════════════
+# LINKING
+# ══════════════════════════════════
+
+# Every candidate in one round trip, all index seeks: the normalized key,
+# plus the raw value for users whose keys haven't been backfilled yet.
+# Each branch stops at hub_cap + 1 rows — enough to tell it's a hub.
+_MATCH_QUERY = "\nUNION\n".join(
+    f"""
+    MATCH (u2:User {{{prop}: ${param}}})
+    WHERE u2.id <> $user_id
+    RETURN '{attr}' AS attr, u2.id AS id LIMIT $limit"""
+    for attr in ATTRIBUTES
+    for prop, param in ((key_property(attr), key_property(attr)), (attr, attr))
+)
+
+# One statement creates every SHARED_* edge for the new user.
+# Relationship types can't be parameters, so FOREACH picks the
+# right MERGE per row.
+_LINK_QUERY = """
+    MATCH (u1:User {id: $user_id})
+    SET u1 += $keys,
+        u1.shared_hub_attributes = $hubs
+    WITH u1
+    UNWIND $links AS link
+    MATCH (u2:User {id: link.other_id})
+""" + "\n".join(
+    f"    FOREACH (_ IN CASE WHEN link.type = '{rel}' THEN [1] ELSE [] END |"
+    f" MERGE (u1)-[:{rel}]->(u2))"
+    for rel in ATTRIBUTES.values()
+)
+
+
+def _link_user(tx, user_data):
+    # Lookup and writes share one transaction, so a retry redoes both
+    keys = _key_params(user_data)
+    raw = {attr: user_data.get(attr) or None for attr in ATTRIBUTES}
+
+    matches = {}
+    for r in tx.run(_MATCH_QUERY, user_id=user_data["id"],
+                    limit=HUB_CAP + 1, **keys, **raw):
+        matches.setdefault(r["attr"], set()).add(r["id"])
+
+    links, hubs = [], []
+    for attr, others in matches.items():
+        if len(others) >= HUB_CAP:   # + this user → over the cap
+            hubs.append(attr)
+            continue
+        links += [{"other_id": other_id, "type": ATTRIBUTES[attr]}
+                  for other_id in sorted(others)]
+
+    tx.run(_LINK_QUERY, user_id=user_data["id"], keys=keys,
+           links=links, hubs=hubs or None)
+    return {"links": len(links), "hubs": hubs}
+
+
+def link_user(user_data: dict):
+    # Finds shared attributes via indexed *_norm keys and writes all links
+    # at once. Hub attributes are recorded on the user instead of linked.
+    result = execute_write(_link_user, user_data)
+    index.add(user_data)
+    return result
+
+
+# ══════════════════════════════════
+# BACKGROUND WORKER
+# ══════════════════════════════════
+
+_stop = threading.Event()
+_thread = None
+
+
+def _run_forever():
+    with background_worker():
+        while not _stop.is_set():
+            try:
+                refresh()
+            except Exception:
+                logger.exception("Attribute index refresh failed, retrying in %ds",
+                                 RETRY_SECONDS)
+                _stop.wait(RETRY_SECONDS)
+                continue
+            _stop.wait(REFRESH_SECONDS)
+
+
+def start_worker():
+    global _thread
+    if _thread and _thread.is_alive():
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_run_forever,
+                               name="attribute-index-worker", daemon=True)
+    _thread.start()
+
+
+def stop_worker(timeout=30):
+    _stop.set()
+    if _thread and _thread.is_alive():
+        _thread.join(timeout)
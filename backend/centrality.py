@@ -0,0 +1,255 @@
+from database import execute_read, write_query, background_worker
+from datetime import datetime, timezone
+import logging
+import os
+import threading
+
+import numpy as np
+import scipy.sparse as sp
+
+logger = logging.getLogger(__name__)
+
+# How often the background worker recomputes scores (seconds)
+INTERVAL_SECONDS = int(os.getenv("CENTRALITY_INTERVAL_SECONDS", "3600"))
+ENABLED = os.getenv("CENTRALITY_ENABLED", "true").lower() == "true"
+# After a failed pass, retry sooner: starts here and doubles up to the cap
+RETRY_SECONDS = int(os.getenv("CENTRALITY_RETRY_SECONDS", "15"))
+MAX_RETRY_SECONDS = 300
+
+PAGERANK_DAMPING = 0.85
+# How much of a user's score comes from their neighbours (vs their own txs)
+RISK_PROPAGATION_ALPHA = float(os.getenv("RISK_PROPAGATION_ALPHA", "0.5"))
+# Weight of one SHARED_* link compared to one SENT transfer
+SHARED_EDGE_WEIGHT = 1.0
+MAX_ITERATIONS = 100
+TOLERANCE = 1e-8
+WRITE_BATCH_SIZE = 500
+
+SHARED_TYPES = "SHARED_EMAIL|SHARED_PHONE|SHARED_ADDRESS|SHARED_PAYMENT"
+
+# metric name in the API → User property written by the worker
+METRIC_PROPERTIES = {
+    "degree":   "degree_score",
+    "pagerank": "pagerank_score",
+    "risk":     "propagated_risk_score",
+}
+
+_stop = threading.Event()
+_thread = None
+
+
+# ══════════════════════════════════
+# GRAPH LOADING
+# ══════════════════════════════════
+
+def _load_graph(tx):
+    # Pulls the user graph out of Neo4j as plain edge lists.
+    # SENT edges are collapsed per (sender, receiver) pair, carrying
+    # the number of transfers, the number of transfers whose Transaction
+    # (and risk_score) was found, and the summed transaction risk.
+    user_ids = [r["id"] for r in tx.run(
+        "MATCH (u:User) RETURN u.id AS id ORDER BY id"
+    )]
+
+    sent = [(r["src"], r["dst"], r["weight"], r["scored"], r["risk"])
+            for r in tx.run("""
+        MATCH (a:User)-[s:SENT]->(b:User)
+        OPTIONAL MATCH (t:Transaction {id: s.tx_id})
+        RETURN a.id AS src, b.id AS dst,
+               count(s) AS weight,
+               count(t.risk_score) AS scored,
+               coalesce(sum(t.risk_score), 0.0) AS risk
+    """)]
+
+    shared = [(r["src"], r["dst"], r["weight"]) for r in tx.run(f"""
+        MATCH (a:User)-[r:{SHARED_TYPES}]->(b:User)
+        RETURN a.id AS src, b.id AS dst, count(r) AS weight
+    """)]
+
+    return user_ids, sent, shared
+
+
+def _sparse(n, index, edges):
+    # Builds an n x n CSR matrix from (src, dst, weight) tuples.
+    # Duplicate (src, dst) pairs are summed by scipy.
+    edges = [(index[s], index[d], w) for s, d, w in edges
+             if s in index and d in index and s != d]
+    if not edges:
+        return sp.csr_matrix((n, n))
+    rows, cols, data = zip(*edges)
+    return sp.csr_matrix((data, (rows, cols)), shape=(n, n), dtype=float)
+
+
+def _row_normalize(matrix):
+    # Turns weights into transition probabilities.
+    # Rows with no out-edges stay all-zero (dangling nodes).
+    out = np.asarray(matrix.sum(axis=1)).ravel()
+    inv = np.zeros_like(out)
+    np.divide(1.0, out, out=inv, where=out > 0)
+    return sp.diags(inv) @ matrix, out == 0
+
+
+# ══════════════════════════════════
+# SCORES
+# ══════════════════════════════════
+
+def degree_scores(adjacency):
+    # Number of distinct users each user is connected to, any direction
+    undirected = ((adjacency + adjacency.T) > 0).astype(float)
+    return np.asarray(undirected.sum(axis=1)).ravel()
+
+
+def pagerank_scores(adjacency):
+    # Classic power-iteration PageRank on the weighted graph.
+    # Callers pass SENT directed and SHARED_* in both directions.
+    # Dangling users hand their rank out uniformly.
+    n = adjacency.shape[0]
+    transition, dangling = _row_normalize(adjacency)
+    transition_t = transition.T.tocsr()
+    rank = np.full(n, 1.0 / n)
+
+    for _ in range(MAX_ITERATIONS):
+        new_rank = (PAGERANK_DAMPING * (transition_t @ rank)
+                    + PAGERANK_DAMPING * rank[dangling].sum() / n
+                    + (1.0 - PAGERANK_DAMPING) / n)
+        if np.abs(new_rank - rank).sum() < TOLERANCE:
+            return new_rank
+        rank = new_rank
+    return rank
+
+
+def risk_propagation_scores(adjacency, seed_risk):
+    # Each user's score blends their own average transaction risk with
+    # the weighted average score of their neighbours:
+    #     r = (1 - a) * seed + a * (P @ r)
+    # Risk flows both ways along SENT and SHARED_* links.
+    # Isolated users simply keep their own risk.
+    undirected = adjacency + adjacency.T
+    transition, isolated = _row_normalize(undirected)
+    alpha = RISK_PROPAGATION_ALPHA
+    risk = seed_risk.copy()
+
+    for _ in range(MAX_ITERATIONS):
+        neighbours = transition @ risk
+        neighbours[isolated] = risk[isolated]
+        new_risk = (1.0 - alpha) * seed_risk + alpha * neighbours
+        if np.abs(new_risk - risk).max() < TOLERANCE:
+            return new_risk
+        risk = new_risk
+    return risk
+
+
+def compute_scores(user_ids, sent, shared):
+    # Returns one row per user, ready for the UNWIND write
+    n = len(user_ids)
+    if n == 0:
+        return []
+    index = {uid: i for i, uid in enumerate(user_ids)}
+
+    sent_counts = _sparse(n, index, [(s, d, w) for s, d, w, _, _ in sent])
+    sent_scored = _sparse(n, index, [(s, d, c) for s, d, _, c, _ in sent])
+    sent_risk   = _sparse(n, index, [(s, d, r) for s, d, _, _, r in sent])
+    shared_links = _sparse(n, index, [(s, d, w * SHARED_EDGE_WEIGHT)
+                                      for s, d, w in shared])
+    adjacency = sent_counts + shared_links
+    # SHARED_* edges are stored one way (lower id → higher id in the seed
+    # script, new → existing user on insert) but have no real direction
+    pagerank_adjacency = sent_counts + shared_links + shared_links.T
+
+    # Seed risk = mean risk_score over every transaction a user sent or received.
+    # Transfers whose Transaction node is missing are left out of the mean.
+    tx_count = (np.asarray(sent_scored.sum(axis=1)).ravel()
+                + np.asarray(sent_scored.sum(axis=0)).ravel())
+    risk_sum = (np.asarray(sent_risk.sum(axis=1)).ravel()
+                + np.asarray(sent_risk.sum(axis=0)).ravel())
+    seed_risk = np.zeros(n)
+    np.divide(risk_sum, tx_count, out=seed_risk, where=tx_count > 0)
+
+    degree   = degree_scores(adjacency)
+    pagerank = pagerank_scores(pagerank_adjacency)
+    risk     = risk_propagation_scores(adjacency, seed_risk)
+
+    return [
+        {
+            "id": uid,
+            "degree": int(degree[i]),
+            "pagerank": float(pagerank[i]),
+            "risk": round(float(risk[i]), 6),
+        }
+        for i, uid in enumerate(user_ids)
+    ]
+
+
+# ══════════════════════════════════
+# NEO4J WRITE-BACK
+# ══════════════════════════════════
+
+def create_score_indexes():
+    # Lets /analytics/top-users ORDER BY the score straight off an index
+    for prop in METRIC_PROPERTIES.values():
+        write_query(
+            f"CREATE INDEX user_{prop}_idx IF NOT EXISTS FOR (u:User) ON (u.{prop})"
+        )
+
+
+def write_scores(rows):
+    # One retryable write transaction per batch; SET makes retries safe
+    updated_at = datetime.now(timezone.utc).isoformat()
+    for i in range(0, len(rows), WRITE_BATCH_SIZE):
+        batch = rows[i:i + WRITE_BATCH_SIZE]
+        write_query("""
+            UNWIND $batch AS row
+            MATCH (u:User {id: row.id})
+            SET u.degree_score = row.degree,
+                u.pagerank_score = row.pagerank,
+                u.propagated_risk_score = row.risk,
+                u.scores_updated_at = $updated_at
+        """, batch=batch, updated_at=updated_at)
+
+
+def refresh_scores():
+    # One full pass: read graph → compute in SciPy → write back
+    create_score_indexes()
+    user_ids, sent, shared = execute_read(_load_graph)
+    rows = compute_scores(user_ids, sent, shared)
+    write_scores(rows)
+    logger.info("Centrality scores refreshed for %d users", len(rows))
+    return len(rows)
+
+
+# ══════════════════════════════════
+# BACKGROUND WORKER
+# ══════════════════════════════════
+
+def _run_forever():
+    # Full interval after a good pass; short, growing backoff after a
+    # failure (e.g. Neo4j still starting) so scores show up quickly
+    retry = RETRY_SECONDS
+    with background_worker():
+        while not _stop.is_set():
+            try:
+                refresh_scores()
+            except Exception:
+                logger.exception("Centrality refresh failed, retrying in %ds", retry)
+                _stop.wait(retry)
+                retry = min(retry * 2, MAX_RETRY_SECONDS)
+                continue
+            retry = RETRY_SECONDS
+            _stop.wait(INTERVAL_SECONDS)
+
+
+def start_worker():
+    global _thread
+    if not ENABLED or (_thread and _thread.is_alive()):
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_run_forever,
+                               name="centrality-worker", daemon=True)
+    _thread.start()
+
+
+def stop_worker(timeout=30):
+    # Waits for an in-flight refresh so it doesn't hit a closed driver
+    _stop.set()
+    if _thread and _thread.is_alive():
+        _thread.join(timeout)
@@ -1,18 +1,139 @@
 from neo4j import GraphDatabase
+from contextlib import contextmanager
 import os
+import threading
 
 # These read the values from docker-compose.yml environment section
 URI = os.getenv("NEO4J_URI", "bolt://localhost:7687")
 USER = os.getenv("NEO4J_USER", "neo4j")
 PASSWORD = os.getenv("NEO4J_PASSWORD", "password123")
+DATABASE = os.getenv("NEO4J_DATABASE") or None   # None = server default
+
+# Connection pool tuning
+POOL_SIZE = int(os.getenv("NEO4J_POOL_SIZE", "100"))
+ACQUISITION_TIMEOUT = float(os.getenv("NEO4J_ACQUISITION_TIMEOUT", "60"))
+FETCH_SIZE = int(os.getenv("NEO4J_FETCH_SIZE", "1000"))
+MAX_RETRY_TIME = float(os.getenv("NEO4J_MAX_RETRY_TIME", "30"))
+# /health/pool reports "saturated" once this share of the pool is in use
+POOL_SATURATION_THRESHOLD = float(os.getenv("NEO4J_POOL_SATURATION_THRESHOLD", "0.9"))
+
+# This creates ONE connection pool that the whole app shares.
+# With a neo4j:// URI the driver routes reads to replicas and
+# writes to the cluster leader.
+driver = GraphDatabase.driver(
+    URI,
+    auth=(USER, PASSWORD),
+    max_connection_pool_size=POOL_SIZE,
+    connection_acquisition_timeout=ACQUISITION_TIMEOUT,
+    max_transaction_retry_time=MAX_RETRY_TIME,
+)
+
+# Shared across sessions so a read always sees the app's earlier writes,
+# even when it lands on a different cluster member
+bookmark_manager = GraphDatabase.bookmark_manager()
+
+_in_use = 0
+_in_use_lock = threading.Lock()
+# Most sessions the app can have open at once = FastAPI worker threads
+# (set at startup) + one per running background worker thread.
+# Until the thread limit is known the pool size is the only limit.
+_thread_limit = None
+_background_workers = 0
 
-# This creates ONE connection that the whole app shares
-driver = GraphDatabase.driver(URI, auth=(USER, PASSWORD))
 
 def get_session():
     # Every time we need to talk to database, we call this
-    
-    return driver.session()
+    return driver.session(database=DATABASE,
+                          fetch_size=FETCH_SIZE,
+                          bookmark_manager=bookmark_manager)
+
+
+@contextmanager
+def _tracked_session():
+    # Counts sessions in flight so /health/pool can report saturation
+    global _in_use
+    with _in_use_lock:
+        _in_use += 1
+    try:
+        with get_session() as session:
+            yield session
+    finally:
+        with _in_use_lock:
+            _in_use -= 1
+
+
+def execute_read(work, *args, **kwargs):
+    # Runs work(tx, ...) in a managed read transaction.
+    # Routed to a reader and retried on transient errors,
+    # so work must only read and must consume its results.
+    with _tracked_session() as session:
+        return session.execute_read(work, *args, **kwargs)
+
+
+def execute_write(work, *args, **kwargs):
+    # Runs work(tx, ...) in a managed write transaction.
+    # Retried on transient errors, so work must be idempotent (MERGE / SET).
+    with _tracked_session() as session:
+        return session.execute_write(work, *args, **kwargs)
+
+
+def _fetch_all(tx, query, params):
+    return list(tx.run(query, params))
+
+
+def read_query(query, **params):
+    # Shortcut for a single read query → list of records
+    return execute_read(_fetch_all, query, params)
+
+
+def write_query(query, **params):
+    # Shortcut for a single write query → list of records
+    return execute_write(_fetch_all, query, params)
+
+
+def check_ready():
+    # Raises if no cluster member for reads/writes can be reached
+    driver.verify_connectivity()
+
+
+def set_thread_limit(limit):
+    # Sync endpoints run on a fixed-size thread pool, so the app can never
+    # open more sessions than that, however big the driver pool is
+    global _thread_limit
+    _thread_limit = limit
+
+
+@contextmanager
+def background_worker():
+    # Wrap a background thread's loop in this so its session counts
+    # towards /health/pool capacity while it runs
+    global _background_workers
+    with _in_use_lock:
+        _background_workers += 1
+    try:
+        yield
+    finally:
+        with _in_use_lock:
+            _background_workers -= 1
+
+
+def pool_status():
+    # The driver has no public pool metrics, so this counts sessions the
+    # app has open (each holds at most one connection) - a proxy for
+    # pool occupancy, measured against the real concurrency limit
+    in_use = _in_use
+    capacity = POOL_SIZE
+    if _thread_limit is not None:
+        capacity = min(POOL_SIZE, _thread_limit + _background_workers)
+    saturation = in_use / capacity if capacity else 1.0
+    return {
+        "in_use": in_use,
+        "capacity": capacity,
+        "max_size": POOL_SIZE,
+        "saturation": round(saturation, 3),
+        "saturated": saturation >= POOL_SATURATION_THRESHOLD,
+    }
+
 
 def close_connection():
-    driver.close()
\ No newline at end of file
+    driver.close()
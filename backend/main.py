@@ -1,11 +1,16 @@
 from fastapi import FastAPI, Query, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, JSONResponse
 from models import User, Transaction
-from database import get_session
+from database import (read_query, write_query, execute_read,
+                      check_ready, pool_status, set_thread_limit,
+                      close_connection)
 from relationships import (detect_user_relationships,
                            detect_transaction_relationships)
+from centrality import METRIC_PROPERTIES, start_worker, stop_worker
+import attribute_index
 from typing import Optional
+import anyio
 import csv
 import io
 
@@ -21,6 +26,34 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Background worker that precomputes degree / PageRank / risk scores
+@app.on_event("startup")
+def start_background_workers():
+    start_worker()
+
+
+# Backfills normalized attribute keys and rebuilds the hub-stats cache,
+# now and on a schedule (retries quickly if Neo4j isn't up yet)
+@app.on_event("startup")
+def start_attribute_index():
+    attribute_index.start_worker()
+
+
+# Sync endpoints run on AnyIO's worker threads, so at most that many
+# sessions (plus one per background worker, which registers itself
+# in database.py) are ever open at once
+@app.on_event("startup")
+async def record_thread_limit():
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    set_thread_limit(int(limiter.total_tokens))
+
+
+@app.on_event("shutdown")
+def stop_background_workers():
+    stop_worker()
+    attribute_index.stop_worker()
+    close_connection()
+
 # ══════════════════════════════════
 # USER ENDPOINTS
 # ══════════════════════════════════
@@ -30,8 +63,7 @@ def create_user(user: User):
     # When frontend sends POST /users with user data:
     # 1. Save user to Neo4j
     # 2. Auto-detect shared attribute links
-    session = get_session()
-    session.run("""
+    write_query("""
         MERGE (u:User {id: $id})
         SET u.name = $name,
             u.email = $email,
@@ -39,9 +71,8 @@ def create_user(user: User):
             u.address = $address,
             u.payment_method = $payment_method
     """, **user.dict())
-    session.close()
-    detect_user_relationships(user.dict())
-    return {"message": "User created", "id": user.id}
+    links = detect_user_relationships(user.dict())
+    return {"message": "User created", "id": user.id, **links}
 
 
 @app.get("/users")
@@ -50,10 +81,8 @@ def get_users(
     limit: int = Query(50, le=500), 
     skip: int = 0                   
 ):
-    session = get_session()
-
     if search:
-        result = session.run("""
+        result = read_query("""
             MATCH (u:User)
             WHERE toLower(u.name) CONTAINS toLower($search)
                OR toLower(u.email) CONTAINS toLower($search)
@@ -62,13 +91,12 @@ def get_users(
             RETURN u SKIP $skip LIMIT $limit
         """, search=search, skip=skip, limit=limit)
     else:
-        result = session.run("""
+        result = read_query("""
             MATCH (u:User)
             RETURN u SKIP $skip LIMIT $limit
         """, skip=skip, limit=limit)
 
     users = [dict(record["u"]) for record in result]
-    session.close()
     return {"data": users, "total": len(users)}
 
 
@@ -78,8 +106,7 @@ def get_users(
 
 @app.post("/transactions", status_code=201)
 def create_transaction(tx: Transaction):
-    session = get_session()
-    session.run("""
+    write_query("""
         MERGE (t:Transaction {id: $id})
         SET t.sender_id = $sender_id,
             t.receiver_id = $receiver_id,
@@ -91,7 +118,6 @@ def create_transaction(tx: Transaction):
             t.status = $status,
             t.risk_score = $risk_score
     """, **tx.dict())
-    session.close()
     detect_transaction_relationships(tx.dict())
     return {"message": "Transaction created", "id": tx.id}
 
@@ -107,7 +133,6 @@ def get_transactions(
     limit: int = Query(50, le=500),
     skip: int = 0
 ):
-    session = get_session()
     filters = []
     params = {"skip": skip, "limit": limit}
 
@@ -129,7 +154,7 @@ def get_transactions(
     where = ("WHERE " + " AND ".join(filters)) if filters else ""
     order_dir = "DESC" if order == "desc" else "ASC"
 
-    result = session.run(f"""
+    result = read_query(f"""
         MATCH (t:Transaction)
         {where}
         RETURN t
@@ -138,7 +163,6 @@ def get_transactions(
     """, **params)
 
     data = [dict(r["t"]) for r in result]
-    session.close()
     return {"data": data, "total": len(data)}
 
 
@@ -152,8 +176,7 @@ def get_user_relationships(user_id: str):
     # - other users they transacted with
     # - users with shared email/phone/address/payment
     # - all their transactions
-    session = get_session()
-    result = session.run("""
+    result = read_query("""
         MATCH (u:User {id: $user_id})-[r]->(n)
         RETURN type(r) as rel_type,
                labels(n) as node_type,
@@ -197,15 +220,13 @@ def get_user_relationships(user_id: str):
         elif rel in ["INITIATED", "RECEIVED"]:
             connections["transactions"].append(node)
 
-    session.close()
     return {"user_id": user_id, "connections": connections}
 
 
 @app.get("/relationships/transaction/{tx_id}")
 def get_transaction_relationships(tx_id: str):
     # Returns everything connected to a transaction.
-    session = get_session()
-    result = session.run("""
+    result = read_query("""
         MATCH (n)-[r]->(t:Transaction {id: $tx_id})
         RETURN type(r) as rel_type,
                labels(n) as node_type,
@@ -239,7 +260,6 @@ def get_transaction_relationships(tx_id: str):
             # Includes SAME_IP and SAME_DEVICE linked transactions
             connections["linked_transactions"].append({"data": node, "link_type": rel})
 
-    session.close()
     return {"transaction_id": tx_id, "connections": connections}
 
 
@@ -250,8 +270,7 @@ def get_transaction_relationships(tx_id: str):
 @app.get("/analytics/shortest-path")
 def shortest_path(user1_id: str, user2_id: str):
     # Shortest chain of connections between any two users
-    session = get_session()
-    result = session.run("""
+    result = read_query("""
         MATCH path = shortestPath(
             (u1:User {id: $user1_id})-[*]-(u2:User {id: $user2_id})
         )
@@ -259,8 +278,7 @@ def shortest_path(user1_id: str, user2_id: str):
                length(path) as hops
     """, user1_id=user1_id, user2_id=user2_id)
 
-    record = result.single()
-    session.close()
+    record = result[0] if result else None
     if not record:
         raise HTTPException(404, "No path found between users")
     return {"path": record["path_ids"], "hops": record["hops"]}
@@ -269,14 +287,50 @@ def shortest_path(user1_id: str, user2_id: str):
 @app.get("/analytics/stats")
 def get_stats():
     # Total counts for the dashboard hero section
-    session = get_session()
-    users   = session.run("MATCH (u:User) RETURN count(u) as c").single()["c"]
-    txs     = session.run("MATCH (t:Transaction) RETURN count(t) as c").single()["c"]
-    flagged = session.run("MATCH (t:Transaction {status:'flagged'}) RETURN count(t) as c").single()["c"]
-    review  = session.run("MATCH (t:Transaction {status:'review'}) RETURN count(t) as c").single()["c"]
-    clear   = session.run("MATCH (t:Transaction {status:'clear'}) RETURN count(t) as c").single()["c"]
-    session.close()
-    return {"users": users, "transactions": txs, "flagged": flagged, "review": review, "clear": clear}
+    # All five counts run in one read transaction
+    def count_all(tx):
+        def count(query):
+            return tx.run(query).single()["c"]
+        return {
+            "users":        count("MATCH (u:User) RETURN count(u) as c"),
+            "transactions": count("MATCH (t:Transaction) RETURN count(t) as c"),
+            "flagged":      count("MATCH (t:Transaction {status:'flagged'}) RETURN count(t) as c"),
+            "review":       count("MATCH (t:Transaction {status:'review'}) RETURN count(t) as c"),
+            "clear":        count("MATCH (t:Transaction {status:'clear'}) RETURN count(t) as c"),
+        }
+    return execute_read(count_all)
+
+
+@app.get("/analytics/top-users")
+def top_users(
+    metric: str = "pagerank",
+    limit: int = Query(20, ge=1, le=500)
+):
+    # Ranks users by a score precomputed by the centrality worker.
+    # Just an index-backed ORDER BY — no graph traversal here.
+    if metric not in METRIC_PROPERTIES:
+        raise HTTPException(400, f"metric must be one of {list(METRIC_PROPERTIES)}")
+    prop = METRIC_PROPERTIES[metric]
+
+    result = read_query(f"""
+        MATCH (u:User)
+        WHERE u.{prop} IS NOT NULL
+        RETURN u
+        ORDER BY u.{prop} DESC
+        LIMIT $limit
+    """, limit=limit)
+    users = [dict(r["u"]) for r in result]
+    return {"metric": metric, "data": users, "total": len(users)}
+
+
+@app.get("/analytics/attribute-hubs")
+def attribute_hubs(top: int = Query(10, ge=1, le=100)):
+    # How many users share each email / phone / address / payment value.
+    # Values above the hub cap are flagged on new users, not linked.
+    # Served from the cache the background worker loads; 503 until then.
+    if not attribute_index.index.loaded:
+        return JSONResponse(status_code=503, content={"loaded": False})
+    return attribute_index.index.stats(top)
 
 
 # ══════════════════════════════════
@@ -286,10 +340,8 @@ def get_stats():
 @app.get("/export/transactions")
 def export_transactions_json():
     # All transactions as JSON
-    session = get_session()
-    result  = session.run("MATCH (t:Transaction) RETURN t")
+    result  = read_query("MATCH (t:Transaction) RETURN t")
     data    = [dict(r["t"]) for r in result]
-    session.close()
     return {"data": data, "count": len(data)}
 
 
@@ -297,14 +349,12 @@ def export_transactions_json():
 def export_transactions_csv():
     # Streams ALL transactions as a downloadable .csv file.
     # Python csv module handles quoting/escaping — safe for Excel & Sheets.
-    session = get_session()
-    result  = session.run("""
+    result  = read_query("""
         MATCH (t:Transaction)
         RETURN t
         ORDER BY t.timestamp DESC
     """)
     rows = [dict(r["t"]) for r in result]
-    session.close()
 
     if not rows:
         raise HTTPException(404, "No transactions to export")
@@ -333,10 +383,8 @@ def export_transactions_csv():
 @app.get("/export/users/csv")
 def export_users_csv():
     # Streams ALL users as a downloadable .csv file
-    session = get_session()
-    result  = session.run("MATCH (u:User) RETURN u ORDER BY u.id ASC")
+    result  = read_query("MATCH (u:User) RETURN u ORDER BY u.id ASC")
     rows    = [dict(r["u"]) for r in result]
-    session.close()
 
     if not rows:
         raise HTTPException(404, "No users to export")
@@ -356,4 +404,29 @@ def export_users_csv():
         iter([buffer.getvalue()]),
         media_type="text/csv",
         headers={"Content-Disposition": "attachment; filename=users_export.csv"}
-    )
\ No newline at end of file
+    )
+
+# ══════════════════════════════════
+# HEALTH ENDPOINTS
+# ══════════════════════════════════
+
+@app.get("/health/ready")
+def readiness():
+    # 200 once Neo4j is reachable, 503 otherwise (for load balancers)
+    try:
+        check_ready()
+    except Exception as e:
+        return JSONResponse(status_code=503,
+                            content={"status": "unavailable", "detail": str(e)})
+    return {"status": "ready"}
+
+
+@app.get("/health/pool")
+async def pool_health():
+    # Open sessions vs. the most the app can open (a proxy for pool use).
+    # async so it answers on the event loop even when the worker thread
+    # pool it is measuring is full; pool_status() never blocks.
+    status = pool_status()
+    if status["saturated"]:
+        return JSONResponse(status_code=503, content={"status": "saturated", **status})
+    return {"status": "ok", **status}
@@ -0,0 +1,124 @@
+import pytest
+
+import attribute_index
+from attribute_index import (AttributeIndex, normalize, normalize_email,
+                             normalize_phone, _link_user)
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("John.Doe+promo@Gmail.com", "johndoe@gmail.com"),
+    ("j.o.h.n.doe@googlemail.com", "johndoe@gmail.com"),
+    ("J.Smith@Corp.com", "j.smith@corp.com"),       # dots matter here
+    ("jsmith+tag@corp.com", "jsmith+tag@corp.com"),
+    ("  Alice@Example.COM ", "alice@example.com"),
+])
+def test_normalize_email(raw, expected):
+    assert normalize_email(raw) == expected
+
+
+def test_corporate_dots_do_not_collide():
+    assert normalize_email("j.smith@corp.com") != normalize_email("jsmith@corp.com")
+
+
+@pytest.mark.parametrize("raw", [
+    "+91-98765-43210", "098765 43210", "9876543210", "(+91) 98765.43210",
+])
+def test_normalize_phone(raw):
+    assert normalize_phone(raw) == "9876543210"
+
+
+def test_blank_values_never_match():
+    assert normalize("email", "") is None
+    assert normalize("address", "  ,. ") is None
+    assert normalize("phone", None) is None
+
+
+def test_address_ignores_punctuation_and_case():
+    assert normalize("address", "Flat 1, MG Road") == normalize("address", "flat 1 mg  road")
+
+
+def _user(uid, **attrs):
+    return {"id": uid, **attrs}
+
+
+def test_reinsert_moves_user_to_new_value():
+    ix = AttributeIndex()
+    ix.add(_user("U1", email="old@x.com"))
+    ix.add(_user("U1", email="new@x.com"))
+    emails = ix.stats()["attributes"]["email"]
+    assert emails["distinct_values"] == 1
+    assert ix.stats()["users"] == 1
+
+
+def test_load_keeps_users_added_during_load():
+    ix = AttributeIndex()
+    ix.begin_load()
+    ix.add(_user("U9", email="new@x.com"))            # POST while snapshot is read
+    ix.load([_user("U9", email="old@x.com"), _user("U1", email="a@x.com")])
+    assert ix._by_user["U9"] == {"email": "new@x.com"}
+    assert set(ix._by_user) == {"U1", "U9"}
+    assert ix.loaded
+
+
+def test_load_drops_deleted_users():
+    ix = AttributeIndex()
+    ix.load([_user("U1", email="a@x.com"), _user("U2", email="a@x.com")])
+    ix.begin_load()
+    ix.load([_user("U1", email="a@x.com")])
+    stats = ix.stats()
+    assert stats["users"] == 1
+    assert stats["attributes"]["email"]["shared_values"] == 0
+
+
+def test_stats_hub_counting():
+    ix = AttributeIndex(hub_cap=2)
+    ix.load([_user(f"U{i}", phone="9876543210") for i in range(3)]
+            + [_user("U9", phone="9000000000"), _user("U8", phone="9000000000")])
+    phone = ix.stats(top=1)["attributes"]["phone"]
+    assert phone["largest"] == 3
+    assert phone["shared_values"] == 2
+    assert phone["over_cap"] == 1
+    assert phone["top"] == [{"value": "9876543210", "users": 3}]
+
+
+class FakeTx:
+    # Answers the UNION lookup with `matches`, records the link write
+    def __init__(self, matches):
+        self.matches = matches
+        self.writes = []
+
+    def run(self, query, **params):
+        if "UNION" in query:
+            return [{"attr": attr, "id": uid} for attr, uid in self.matches]
+        self.writes.append(params)
+        return []
+
+
+@pytest.mark.parametrize("shared_by, linked", [
+    (3, True),    # exactly HUB_CAP users share the value → still linked
+    (4, False),   # HUB_CAP + 1 → flagged as a hub
+])
+def test_link_user_hub_cap_boundary(monkeypatch, shared_by, linked):
+    monkeypatch.setattr(attribute_index, "HUB_CAP", 3)
+    others = [("email", f"U{i}") for i in range(shared_by - 1)]   # + the new user
+    tx = FakeTx(others)
+    result = _link_user(tx, _user("NEW", email="a@x.com"))
+    write = tx.writes[0]
+    if linked:
+        assert result == {"links": shared_by - 1, "hubs": []}
+        assert write["hubs"] is None
+        assert {l["type"] for l in write["links"]} == {"SHARED_EMAIL"}
+    else:
+        assert result == {"links": 0, "hubs": ["email"]}
+        assert write["hubs"] == ["email"]
+        assert write["links"] == []
+
+
+def test_link_user_writes_normalized_keys():
+    tx = FakeTx([("phone", "U1"), ("phone", "U1")])
+    _link_user(tx, _user("NEW", email="A.B@gmail.com", phone="+91-98765-43210",
+                         address="", payment_method="Card_1"))
+    write = tx.writes[0]
+    assert write["keys"] == {"email_norm": "ab@gmail.com", "phone_norm": "9876543210",
+                             "address_norm": None, "payment_method_norm": "card_1"}
+    assert write["links"] == [{"other_id": "U1", "type": "SHARED_PHONE"}]
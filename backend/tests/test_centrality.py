@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from centrality import (compute_scores, pagerank_scores,
+                        risk_propagation_scores, _sparse)
+
+
+def _matrix(n, edges):
+    return _sparse(n, {i: i for i in range(n)}, edges)
+
+
+def test_pagerank_sums_to_one():
+    adjacency = _matrix(4, [(0, 1, 1.0), (1, 2, 2.0), (2, 0, 1.0)])  # 3 is dangling
+    rank = pagerank_scores(adjacency)
+    assert rank.sum() == pytest.approx(1.0)
+    assert (rank > 0).all()
+
+
+def test_isolated_user_keeps_seed_risk():
+    adjacency = _matrix(3, [(0, 1, 1.0)])
+    seed = np.array([0.2, 0.8, 0.9])
+    risk = risk_propagation_scores(adjacency, seed)
+    assert risk[2] == pytest.approx(0.9)
+    # Connected users pull towards each other
+    assert 0.2 < risk[0] < risk[1] < 0.8
+
+
+def test_shared_links_are_undirected_for_pagerank():
+    # Same shared link stored either way round must rank the same
+    forward  = compute_scores(["A", "B", "C"], [], [("A", "B", 1)])
+    backward = compute_scores(["A", "B", "C"], [], [("B", "A", 1)])
+    assert [r["pagerank"] for r in forward] == pytest.approx(
+        [r["pagerank"] for r in backward])
+    assert forward[0]["pagerank"] == pytest.approx(forward[1]["pagerank"])
+
+
+def test_seed_risk_ignores_transfers_without_transaction():
+    # A→B: 2 transfers, only 1 Transaction found, with risk 0.8
+    rows = compute_scores(["A", "B"], [("A", "B", 2, 1, 0.8)], [])
+    by_id = {r["id"]: r for r in rows}
+    assert by_id["A"]["risk"] == pytest.approx(0.8)
+    assert by_id["B"]["risk"] == pytest.approx(0.8)
+    assert by_id["A"]["degree"] == 1
+
+
+def test_no_users():
+    assert compute_scores([], [], []) == []
@@ -0,0 +1,12 @@
+import database
+
+
+def test_pool_capacity_counts_background_workers(monkeypatch):
+    monkeypatch.setattr(database, "_thread_limit", 4)
+    monkeypatch.setattr(database, "_background_workers", 0)
+    monkeypatch.setattr(database, "_in_use", 5)
+    with database.background_worker(), database.background_worker():
+        status = database.pool_status()
+        assert status["capacity"] == 6
+        assert status["saturation"] <= 1.0
+    assert database._background_workers == 0